@@ -3,22 +3,31 @@ from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import requests
-import json
-from typing import List, Dict, Optional
+import orjson
+import hashlib
+from functools import lru_cache
+from typing import AsyncGenerator, List, Dict, Optional
 import asyncio
+import contextlib
 import httpx
 from sql_service import get_sql_service
+from http_client import post_json, stream_json, close_client
+from shared_cache import close_redis, register_stream, request_stop, unregister_stream, watch_stop
 from query_classifier import get_classifier
+from planner import get_planner
+from rag_cache import CachedRAG, RAGResult
 import config
 
 app = FastAPI(title="SQL Data Analysis Chatbot API")
 
-# 진행 중인 요청 추적 (중단 기능용)
-active_requests: Dict[str, bool] = {}
+# 진행 중인 요청 추적 (중단 기능용, set()되면 중단, 다른 워커의 중단 요청은 Redis 플래그로 반영)
+active_requests: Dict[str, asyncio.Event] = {}
 
-# 동시 LLM 요청 제한 (vLLM 과부하 방지)
-llm_semaphore = asyncio.Semaphore(64)
+# 실제 워커 수 (Redis 없이 여러 워커를 띄우면 캐시/중단 상태가 워커마다 갈라지므로 1로 고정)
+WORKERS = max(1, config.WORKERS) if config.REDIS_URL else 1
+
+# 동시 LLM 요청 제한 (vLLM 과부하 방지, 전체 한도를 워커 수로 나눠 적용)
+llm_semaphore = asyncio.Semaphore(max(1, config.LLM_MAX_CONCURRENCY // WORKERS))
 
 # CORS 설정
 app.add_middleware(
@@ -29,13 +38,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# SQL 서비스 초기화
-try:
-    sql_service = get_sql_service()
-    print("✓ SQL 서비스 초기화 완료")
-except Exception as e:
-    print(f"✗ SQL 서비스 초기화 실패: {e}")
-    sql_service = None
+# SQL 서비스 (startup 이벤트에서 초기화)
+sql_service = None
 
 # 요청 모델
 class ChatRequest(BaseModel):
@@ -55,13 +59,76 @@ class ChatResponse(BaseModel):
 class StopRequest(BaseModel):
     request_id: str
 
-def get_system_prompt(rag_context: str) -> str:
-    """시스템 프롬프트 생성"""
-    if rag_context:
-        return f"""당신은 SQL 데이터 분석 전문가입니다.
+# SSE 출력 버퍼
+class OutBuffer:
+    """작은 SSE 프레임을 모아서 전송 (max_bytes 이상 모이거나 max_delay가 지나면 flush)"""
+
+    def __init__(
+        self,
+        source: AsyncGenerator[bytes, None],
+        max_bytes: int = None,
+        max_delay: float = None,
+        max_pending: int = None
+    ):
+        self.source = source
+        self.max_bytes = max_bytes or config.STREAM_FLUSH_BYTES
+        self.max_delay = max_delay or config.STREAM_FLUSH_INTERVAL_MS / 1000
+        self.max_pending = max_pending or config.STREAM_QUEUE_MAXSIZE
+
+    async def __aiter__(self):
+        # 원본 스트림은 별도 태스크에서 읽어 큐에 넣고, 여기서는 타이머 기준으로 묶어서 내보냄
+        # 큐 크기를 제한해 클라이언트가 느리면 producer도 멈추도록 함 (vLLM 읽기에 backpressure 전달)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_pending)
+        producer = asyncio.create_task(self._produce(queue))
+        loop = asyncio.get_running_loop()
+        buf = bytearray()
+        deadline = 0.0
 
-=== 검색된 데이터 ===
-{rag_context}
+        try:
+            while True:
+                timeout = max(deadline - loop.time(), 0) if buf else None
+                try:
+                    frame = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield bytes(buf)
+                    buf.clear()
+                    continue
+
+                if frame is None:
+                    break
+
+                if not buf:
+                    deadline = loop.time() + self.max_delay
+                buf += frame
+                if len(buf) >= self.max_bytes:
+                    yield bytes(buf)
+                    buf.clear()
+
+            if buf:
+                yield bytes(buf)
+        finally:
+            # producer가 queue.put에서 막혀 있으면 원본 제너레이터는 yield에 멈춘 채로 남으므로
+            # 취소가 끝날 때까지 기다린 뒤 원본을 직접 닫아 finally(세마포어 반환, 스트림 정리)를 실행
+            producer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await producer
+            await self.source.aclose()
+
+    async def _produce(self, queue: asyncio.Queue):
+        cancelled = False
+        try:
+            async for frame in self.source:
+                await queue.put(frame)
+        except asyncio.CancelledError:
+            # 소비자가 먼저 끝난 경우: 종료 표시를 받을 쪽이 없고 큐가 가득 차 있을 수 있음
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                await queue.put(None)
+
+# RAG 답변용 고정 지시문 (페르소나 + 규칙, 항상 같은 바이트로 프롬프트 맨 앞에 배치)
+RAG_SYSTEM_PROMPT = """당신은 SQL 데이터 분석 전문가입니다.
 
 답변 작성 규칙:
 1. **데이터 완전성**: 검색된 모든 데이터를 빠짐없이 표시
@@ -74,70 +141,133 @@ def get_system_prompt(rag_context: str) -> str:
 
    파이 차트:
    ```chartjs
-   {{
+   {
      "type": "pie",
      "title": "제목",
      "labels": ["항목1", "항목2"],
      "data": [값1, 값2]
-   }}
+   }
    ```
 
    막대 그래프:
    ```chartjs
-   {{
+   {
      "type": "bar",
      "title": "제목",
      "labels": ["항목1", "항목2"],
      "data": [값1, 값2]
-   }}
+   }
    ```
 5. 숫자는 정확하게, 간결하고 명확하게"""
-    else:
-        return """당신은 친절하고 전문적인 AI 어시스턴트입니다.
+
+# 일반 대화용 시스템 프롬프트
+NO_RAG_SYSTEM_PROMPT = """당신은 친절하고 전문적인 AI 어시스턴트입니다.
 사용자의 질문에 정확하고 도움이 되는 답변을 제공하세요."""
 
-async def process_query(user_query: str, use_rag: Optional[bool], top_k: int):
-    """질문 처리 및 RAG 컨텍스트 생성"""
-    import time
+def get_system_prompt(rag_context: str) -> str:
+    """
+    시스템 프롬프트 생성
+
+    고정 지시문 → 검색 데이터 순서로 배치하고 해시 마커를 붙여,
+    같은 검색 결과가 반복되면 정확히 같은 바이트가 전송되도록 합니다 (vLLM prefix cache 재사용).
+    """
+    if rag_context:
+        ctx_hash = hashlib.blake2b(rag_context.encode("utf-8"), digest_size=8).hexdigest()
+        return f"""{RAG_SYSTEM_PROMPT}
+
+<!--ctx:{ctx_hash}-->
+=== 검색된 데이터 ===
+{rag_context}"""
+    else:
+        return NO_RAG_SYSTEM_PROMPT
+
+# 일반 대화용 시스템 메시지 (요청마다 새로 만들지 않는 싱글톤)
+_SYS_NO_RAG = {"role": "system", "content": NO_RAG_SYSTEM_PROMPT}
+
+# 캐시는 여기 한 곳만 둠 (get_system_prompt까지 캐시하면 큰 rag_context 키가 두 벌 유지됨)
+@lru_cache(maxsize=256)
+def _build_rag_system_message(rag_context: str) -> Dict[str, str]:
+    return {"role": "system", "content": get_system_prompt(rag_context)}
+
+def get_system_message(rag_context: str) -> Dict[str, str]:
+    """시스템 메시지 dict 반환 (읽기 전용으로 공유되므로 수정하지 말 것)"""
+    if not rag_context:
+        return _SYS_NO_RAG
+    return _build_rag_system_message(rag_context)
 
+async def build_rag_context(user_query: str, use_rag: Optional[bool], top_k: int) -> RAGResult:
+    """질문 처리 및 RAG 컨텍스트 생성 (캐시 미적용)"""
     rag_context = ""
+    entities = None
+    cacheable = True
+    plan = None
+    rag_config = None
     debug_info = {}
 
     # RAG 사용 여부 자동 판단
-    if use_rag is None:
-        classifier = get_classifier()
-        use_rag_decision, rag_config, debug_info = classifier.classify(user_query) if user_query else (False, None, {})
+    if use_rag is None and not user_query:
+        use_rag_decision = False
+    elif use_rag is None and config.USE_LEGACY_CLASSIFIER:
+        # 디버그용 3-Layer 경로 (분류 LLM 2회 + SQL 생성 LLM 1회)
+        classifier = await get_classifier()
+        use_rag_decision, rag_config, debug_info = await classifier.classify(user_query)
+    elif use_rag is None:
+        # 판단 + SQL 계획을 LLM 1회 호출로 처리
+        plan = await (await get_planner()).plan(user_query)
+        use_rag_decision = plan.requires_rag
     else:
         use_rag_decision = use_rag
-        rag_config = None
+
+    # LLM 실패로 키워드 기반 판단을 쓴 결과는 캐시하지 않음 (일시 오류가 "데이터 없음"으로 굳지 않도록)
+    if (plan and plan.fallback) or debug_info.get("fallback"):
+        cacheable = False
 
     if use_rag_decision and user_query and sql_service:
         try:
-            if rag_config:
-                search_query = rag_config.search_query
-                search_method = rag_config.search_method
+            if plan and plan.main_sql:
+                entities = plan.entities
+                sql_results, sql_query, query_type, total_stores = await sql_service.search_with_sql(
+                    plan.main_sql, plan.total_count_sql, plan.query_type
+                )
             else:
                 search_query = user_query
-                search_method = "sql"
+                question_type = None
+                if plan:
+                    entities = plan.entities
+                elif rag_config:
+                    search_query = rag_config.search_query
+                    entities = debug_info.get('layer1_analysis', {}).get('entities')
+                    question_type = debug_info.get('layer1_analysis', {}).get('question_type')
 
-            if search_method in ["sql", "both"]:
-                entities = debug_info.get('layer1_analysis', {}).get('entities') if debug_info else None
-                question_type = debug_info.get('layer1_analysis', {}).get('question_type') if debug_info else None
+                sql_results, sql_query, query_type, total_stores = await sql_service.search(search_query, entities, question_type)
 
-                sql_results, sql_query, query_type, total_stores = sql_service.search(search_query, entities, question_type)
-                rag_context = sql_service.format_results_for_llm(sql_results, query_type, total_stores)
+            rag_context = sql_service.format_results_for_llm(sql_results, query_type, total_stores)
 
         except Exception as e:
             print(f"SQL 검색 오류: {e}")
+            cacheable = False
+    elif use_rag_decision:
+        cacheable = False
 
-    return rag_context, use_rag_decision
+    return RAGResult(
+        rag_context=rag_context,
+        use_rag_decision=use_rag_decision,
+        entities=entities or {},
+        cacheable=cacheable
+    )
 
-@app.get("/", response_class=HTMLResponse)
-async def read_root():
-    """메인 페이지 반환"""
+# 분류기 + SQL 검색 결과 캐시 (process_query 래퍼, DB 경로는 startup에서 연결)
+process_query = CachedRAG(build_rag_context)
+
+def _read_index_html() -> str:
     with open("static/index.html", "r", encoding="utf-8") as f:
         return f.read()
 
+@app.get("/", response_class=HTMLResponse)
+async def read_root():
+    """메인 페이지 반환 (파일 읽기는 스레드에서 수행하여 이벤트 루프 차단 방지)"""
+    return await asyncio.to_thread(_read_index_html)
+
 @app.post("/api/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """일반 채팅 API (스트리밍 없음)"""
@@ -147,25 +277,24 @@ async def chat(request: ChatRequest):
     user_query = request.messages[-1].get("content", "") if request.messages else ""
     rag_context, _ = await process_query(user_query, request.use_rag, request.top_k)
 
-    system_prompt = get_system_prompt(rag_context)
-    messages = [{"role": "system", "content": system_prompt}, *request.messages]
+    # 시스템 메시지는 캐시된 dict를 재사용하고, 리스트 대신 튜플로 묶어 orjson으로 바로 직렬화
+    messages = (get_system_message(rag_context), *request.messages)
 
     try:
-        timeout_config = httpx.Timeout(10.0, read=300.0)
-        async with httpx.AsyncClient(timeout=timeout_config) as client:
-            response = await client.post(
-                config.VLLM_API_URL,
-                json={
-                    "model": config.MODEL_ID,
-                    "messages": messages,
-                    "max_tokens": request.max_tokens,
-                    "temperature": request.temperature
-                }
-            )
-            response.raise_for_status()
-            result = response.json()
-            assistant_message = result["choices"][0]["message"]["content"]
-            return ChatResponse(message=assistant_message, success=True)
+        response = await post_json(
+            config.VLLM_API_URL,
+            {
+                "model": config.MODEL_ID,
+                "messages": messages,
+                "max_tokens": request.max_tokens,
+                "temperature": request.temperature
+            },
+            timeout=httpx.Timeout(10.0, read=300.0)
+        )
+        response.raise_for_status()
+        result = response.json()
+        assistant_message = result["choices"][0]["message"]["content"]
+        return ChatResponse(message=assistant_message, success=True)
 
     except httpx.TimeoutException:
         raise HTTPException(status_code=504, detail="Request timeout")
@@ -184,82 +313,141 @@ async def chat_stream(request: ChatRequest):
     user_query = request.messages[-1].get("content", "") if request.messages else ""
     rag_context, _ = await process_query(user_query, request.use_rag, request.top_k)
 
-    system_prompt = get_system_prompt(rag_context)
-    messages = [{"role": "system", "content": system_prompt}, *request.messages]
+    # 시스템 메시지는 캐시된 dict를 재사용하고, 리스트 대신 튜플로 묶어 orjson으로 바로 직렬화
+    messages = (get_system_message(rag_context), *request.messages)
 
     req_id = request.request_id or f"req_{asyncio.get_event_loop().time()}"
-    active_requests[req_id] = True
+    stop_event = asyncio.Event()
+    active_requests[req_id] = stop_event
+    await register_stream(req_id)
 
     async def generate():
         async with llm_semaphore:
+            stop_watcher = asyncio.create_task(
+                watch_stop(req_id, stop_event, config.STREAM_STOP_POLL_INTERVAL)
+            )
             try:
-                timeout_config = httpx.Timeout(30.0, read=300.0, write=30.0)
-                async with httpx.AsyncClient(timeout=timeout_config) as client:
-                    async with client.stream(
-                        "POST",
-                        config.VLLM_API_URL,
-                        json={
-                            "model": config.MODEL_ID,
-                            "messages": messages,
-                            "max_tokens": request.max_tokens,
-                            "temperature": request.temperature,
-                            "stream": True,
-                        }
-                    ) as response:
-                        response.raise_for_status()
-                        buffer = b""
-                        async for chunk in response.aiter_bytes(chunk_size=1024):
-                            if not active_requests.get(req_id, True):
-                                yield f"data: {json.dumps({'content': '', 'stopped': True})}\n\n"
+                async with stream_json(
+                    config.VLLM_API_URL,
+                    {
+                        "model": config.MODEL_ID,
+                        "messages": messages,
+                        "max_tokens": request.max_tokens,
+                        "temperature": request.temperature,
+                        "stream": True,
+                    },
+                    timeout=httpx.Timeout(30.0, read=300.0, write=30.0)
+                ) as response:
+                    response.raise_for_status()
+                    # 버퍼를 매번 split/재할당하지 않고 읽기 위치(start)만 전진
+                    # (chunk_size를 주면 httpx가 그만큼 모을 때까지 yield하지 않으므로 소켓에서 받은 만큼 바로 처리)
+                    buf = bytearray()
+                    start = 0
+                    async for chunk in response.aiter_bytes():
+                        if stop_event.is_set():
+                            yield b"data: " + orjson.dumps({'content': '', 'stopped': True}) + b"\n\n"
+                            break
+
+                        buf += chunk
+                        while True:
+                            nl = buf.find(b'\n', start)
+                            if nl == -1:
                                 break
+                            line_bytes = buf[start:nl].strip()
+                            start = nl + 1
 
-                            buffer += chunk
-                            lines = buffer.split(b'\n')
-                            buffer = lines[-1]
-
-                            for line_bytes in lines[:-1]:
-                                try:
-                                    line = line_bytes.decode('utf-8').strip()
-                                    if not line or not line.startswith('data: '):
-                                        continue
-
-                                    data_str = line[6:]
-                                    if data_str.strip() == '[DONE]':
-                                        break
-
-                                    data_json = json.loads(data_str)
-                                    if 'choices' in data_json and len(data_json['choices']) > 0:
-                                        choice = data_json['choices'][0]
-                                        content = None
-                                        if 'delta' in choice and 'content' in choice['delta']:
-                                            content = choice['delta']['content']
-                                        elif 'text' in choice:
-                                            content = choice['text']
-
-                                        if content:
-                                            yield f"data: {json.dumps({'content': content})}\n\n"
-                                except (json.JSONDecodeError, UnicodeDecodeError):
-                                    continue
+                            if not line_bytes.startswith(b'data: '):
+                                continue
+
+                            data_bytes = line_bytes[6:].strip()
+                            if data_bytes == b'[DONE]':
+                                break
+
+                            try:
+                                data_json = orjson.loads(data_bytes)
+                            except orjson.JSONDecodeError:
+                                continue
+
+                            choices = data_json.get('choices')
+                            if choices:
+                                choice = choices[0]
+                                content = None
+                                if 'delta' in choice and 'content' in choice['delta']:
+                                    content = choice['delta']['content']
+                                elif 'text' in choice:
+                                    content = choice['text']
+
+                                if content:
+                                    yield b"data: " + orjson.dumps({'content': content}) + b"\n\n"
+
+                        # 소비한 앞부분은 가끔만 잘라내서 복사 비용을 분산
+                        if start == len(buf):
+                            buf.clear()
+                            start = 0
+                        elif start > 16384:
+                            del buf[:start]
+                            start = 0
             except Exception as e:
-                yield f"data: {json.dumps({'error': str(e)})}\n\n"
+                yield b"data: " + orjson.dumps({'error': str(e)}) + b"\n\n"
             finally:
-                if req_id in active_requests:
-                    del active_requests[req_id]
+                stop_watcher.cancel()
+                active_requests.pop(req_id, None)
+                await unregister_stream(req_id)
 
-    return StreamingResponse(generate(), media_type="text/event-stream")
+    return StreamingResponse(
+        OutBuffer(generate()),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/api/chat/stop")
 async def stop_generation(stop_request: StopRequest):
     """LLM 응답 생성 중단 API"""
     request_id = stop_request.request_id
-    if request_id in active_requests:
-        active_requests[request_id] = False
+    stop_event = active_requests.get(request_id)
+    if stop_event is not None:
+        stop_event.set()
+        return {"success": True, "message": f"Request {request_id} stopped"}
+    # 다른 워커에서 스트리밍 중인 요청
+    if await request_stop(request_id):
         return {"success": True, "message": f"Request {request_id} stopped"}
     return {"success": False, "message": f"Request {request_id} not found"}
 
+@app.on_event("startup")
+async def startup():
+    """SQL 서비스 초기화 및 RAG 캐시 임베딩 모델 로드 시작"""
+    global sql_service
+    try:
+        sql_service = await get_sql_service()
+        process_query.bind_db(sql_service.db_path)
+        print("✓ SQL 서비스 초기화 완료")
+    except Exception as e:
+        print(f"✗ SQL 서비스 초기화 실패: {e}")
+        sql_service = None
+
+    # 임베딩 모델은 요청 경로에서 기다리지 않도록 백그라운드로 로드 (로드 전에는 정확 일치 캐시만 사용)
+    process_query.start_encoder()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """공용 HTTP 클라이언트 / Redis 연결 정리"""
+    await close_client()
+    await close_redis()
+
 # Static 파일 서빙
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host=config.HOST, port=config.PORT)
+    if WORKERS < config.WORKERS:
+        print(f"⚠ REDIS_URL이 없어 워커 {config.WORKERS}개 대신 1개로 실행합니다")
+    # 멀티 워커는 import 문자열로 실행해야 함 (워커 간 캐시는 Redis로 공유)
+    # loop/http는 기본값 "auto" 사용 (uvloop/httptools가 설치된 환경에서만 자동 선택)
+    uvicorn.run(
+        "app:app",
+        host=config.HOST,
+        port=config.PORT,
+        workers=WORKERS,
+        server_header=False,
+        backlog=2048
+    )
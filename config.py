@@ -6,10 +6,39 @@ SQL 챗봇 설정 파일
 # vLLM 설정
 VLLM_API_URL = "http://localhost:8000/v1/chat/completions"
 MODEL_ID = "/model"  # vLLM 실행 시 사용된 모델 ID
+LLM_SEED = 42  # 분류/SQL 생성 호출의 고정 seed (temperature=0과 함께 결정적 출력)
+LLM_OUTPUT_CACHE_MAXSIZE = 4096  # 결정적 호출 응답 캐시 최대 항목 수
+LLM_OUTPUT_CACHE_TTL = 600  # 결정적 호출 응답 캐시 유지 시간 (초)
+LLM_MAX_CONCURRENCY = 64  # 동시 LLM 스트리밍 요청 수 (전체 워커 합산, 워커마다 WORKERS로 나눠 적용)
+
+# 질문 분류 설정
+USE_LEGACY_CLASSIFIER = False  # True면 3-Layer 분류기 + 별도 SQL 생성 경로 사용 (디버그용)
 
 # RAG 검색 설정
 DEFAULT_TOP_K = 30  # 기본 검색 결과 수
+SQL_POOL_SIZE = 16  # SQLite 연결 풀 크기
+SQL_CACHE_MAXSIZE = 2048  # SQL 결과 캐시 최대 항목 수
+SQL_CACHE_TTL = 120  # SQL 결과 캐시 유지 시간 (초)
+SQL_CACHE_POLL_INTERVAL = 1.0  # DB 변경 감지 주기 (초)
 
 # 서버 설정
 HOST = "0.0.0.0"
 PORT = 7860
+WORKERS = 1  # Uvicorn 워커 수 (2 이상은 REDIS_URL 필요, 워커마다 임베딩 모델/DB 연결 풀을 따로 로드)
+
+# 공유 캐시 설정 (멀티 워커 간 RAG/SQL 결과 캐시 공유, None이면 워커별 로컬 캐시)
+REDIS_URL = None  # 예: "redis://localhost:6379/0"
+REDIS_TIMEOUT = 0.5  # Redis 연결/응답 타임아웃 (초)
+REDIS_RETRY_INTERVAL = 5.0  # Redis 오류 후 Redis 호출을 건너뛰는 시간 (초, 그동안 로컬 캐시 사용)
+
+# 스트리밍 전송 설정 (작은 토큰 프레임을 묶어서 전송)
+STREAM_FLUSH_BYTES = 4096  # 이 크기 이상 모이면 즉시 전송
+STREAM_FLUSH_INTERVAL_MS = 10  # 첫 프레임 이후 최대 대기 시간 (ms)
+STREAM_QUEUE_MAXSIZE = 256  # 전송 대기 중인 최대 프레임 수 (초과 시 vLLM 스트림 읽기를 멈춤)
+STREAM_STOP_POLL_INTERVAL = 0.25  # 다른 워커에서 들어온 중단 요청 확인 주기 (초, Redis 사용 시)
+
+# RAG 캐시 설정
+RAG_CACHE_MAXSIZE = 10000  # 최대 캐시 항목 수
+RAG_CACHE_TTL = 600  # 캐시 유지 시간 (초)
+RAG_CACHE_SIMILARITY = 0.95  # 유사 질문 재사용 최소 코사인 유사도
+RAG_CACHE_EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
@@ -0,0 +1,102 @@
+"""
+공용 HTTP 클라이언트 모듈
+vLLM 호출에 사용하는 httpx.AsyncClient 싱글톤 (HTTP/2 + keep-alive 연결 풀)
+
+요청마다 클라이언트를 새로 만들지 않고 이 CLIENT를 재사용하세요.
+요청 본문은 post_json / stream_json을 통해 orjson으로 직렬화합니다.
+temperature=0 + seed 고정 요청은 post_completion에서 끝까지 생성된 정상 응답만 TTL 캐시합니다.
+"""
+
+import hashlib
+from typing import Any, Dict, Optional, Type
+
+import httpx
+import orjson
+from cachetools import TTLCache
+from pydantic import BaseModel, ValidationError
+import config
+
+CLIENT = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_keepalive_connections=128, max_connections=256),
+    timeout=httpx.Timeout(10.0, read=30.0)
+)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# 결정적 요청의 응답 캐시 (요청 본문 해시 → 응답 JSON)
+# temperature=0이어도 배치 구성에 따라 출력이 달라질 수 있으므로 TTL로 재사용 기간을 제한
+_completion_cache: TTLCache = TTLCache(
+    maxsize=config.LLM_OUTPUT_CACHE_MAXSIZE, ttl=config.LLM_OUTPUT_CACHE_TTL
+)
+
+
+async def post_json(url: str, payload: Dict[str, Any], **kwargs) -> httpx.Response:
+    """orjson으로 직렬화한 JSON 본문 POST (httpx 내부 json 인코더 생략)"""
+    return await CLIENT.post(url, content=orjson.dumps(payload), headers=JSON_HEADERS, **kwargs)
+
+
+def _completion_key(url: str, body: bytes, payload: Dict[str, Any]) -> Optional[bytes]:
+    """같은 입력이면 같은 출력이 나오는 요청만 캐시 키 생성"""
+    if payload.get("temperature") != 0 or "seed" not in payload:
+        return None
+    return hashlib.blake2b(url.encode("utf-8") + b"\x00" + body, digest_size=16).digest()
+
+
+def _is_reusable(result: Dict[str, Any], schema: Optional[Type[BaseModel]]) -> bool:
+    """max_tokens로 잘리지 않았고 (schema가 주어지면) 스키마 검증을 통과한 응답인지 확인"""
+    try:
+        choice = result["choices"][0]
+        if choice.get("finish_reason") != "stop":
+            return False
+        if schema is not None:
+            schema.model_validate_json(choice["message"]["content"])
+    except (KeyError, IndexError, TypeError, ValidationError):
+        return False
+    return True
+
+
+async def post_completion(
+    url: str,
+    payload: Dict[str, Any],
+    schema: Optional[Type[BaseModel]] = None,
+    **kwargs
+) -> Dict[str, Any]:
+    """
+    chat completion 호출 후 응답 JSON 반환
+
+    temperature=0 + seed가 지정된 결정적 요청은 동일 본문에 대해 캐시된 응답을 재사용합니다.
+    finish_reason이 "stop"이 아니거나 schema 검증에 실패한 응답은 캐시하지 않습니다.
+    """
+    body = orjson.dumps(payload)
+    key = _completion_key(url, body, payload)
+    if key is not None:
+        cached = _completion_cache.get(key)
+        if cached is not None:
+            return cached
+
+    response = await CLIENT.post(url, content=body, headers=JSON_HEADERS, **kwargs)
+    response.raise_for_status()
+    result = response.json()
+
+    if key is not None and _is_reusable(result, schema):
+        _completion_cache[key] = result
+    return result
+
+
+def stream_json(url: str, payload: Dict[str, Any], **kwargs):
+    """orjson으로 직렬화한 JSON 본문 스트리밍 POST (async with로 사용)"""
+    return CLIENT.stream("POST", url, content=orjson.dumps(payload), headers=JSON_HEADERS, **kwargs)
+
+
+def json_schema_format(name: str, schema: Type[BaseModel]) -> Dict[str, Any]:
+    """vLLM 구조화 출력(response_format) 설정 생성 - 스키마에 맞는 JSON만 디코딩"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "schema": schema.model_json_schema()}
+    }
+
+
+async def close_client():
+    """서버 종료 시 연결 풀 정리"""
+    await CLIENT.aclose()
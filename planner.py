@@ -0,0 +1,171 @@
+"""
+LLM 기반 질의 계획 모듈
+질문 분석, RAG 필요 여부 판단, SQL 생성을 한 번의 LLM 호출로 처리합니다.
+
+3-Layer 분류기(query_classifier.LLMQueryClassifier) + SQL 생성(sql_service)은
+LLM 호출 3회가 순차로 이어지므로, 일반 요청은 이 모듈의 PlannerLLM을 사용합니다.
+3-Layer 경로는 config.USE_LEGACY_CLASSIFIER로 디버그 시에만 사용합니다.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Literal, Optional
+
+from pydantic import BaseModel
+from http_client import json_schema_format, post_completion
+from query_classifier import EntitiesSchema, fallback_analysis, fallback_decision
+from sql_service import get_sql_service
+import config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# ==================== Data Classes ====================
+
+@dataclass
+class Plan:
+    """PlannerLLM 출력: RAG 판단 + SQL 계획"""
+    requires_rag: bool  # RAG 필요 여부
+    entities: Dict[str, Any] = field(default_factory=dict)  # 추출된 엔티티
+    main_sql: Optional[str] = None  # 메인 SQL (RAG 불필요 또는 생성 실패 시 None)
+    total_count_sql: Optional[str] = None  # 총 개수 조회 SQL
+    query_type: str = "aggregation"  # aggregation | count | lookup
+    fallback: bool = False  # LLM 실패로 키워드 기반 판단을 사용했는지 여부 (결과 캐시 금지)
+
+
+class PlanSchema(BaseModel):
+    """질의 계획 응답 스키마 (vLLM 구조화 출력용)"""
+    entities: EntitiesSchema
+    requires_rag: bool
+    main_sql: Optional[str] = None
+    total_count_sql: Optional[str] = None
+    query_type: Literal["aggregation", "count", "lookup"]
+
+
+PLAN_RESPONSE_FORMAT = json_schema_format("plan", PlanSchema)
+
+
+# ==================== Planner ====================
+
+class PlannerLLM:
+    """질문 분석 + RAG 판단 + SQL 생성을 한 번에 수행하는 플래너"""
+
+    def __init__(self, schema_info: str, vllm_url: str = None, model_id: str = None):
+        self.vllm_url = vllm_url or config.VLLM_API_URL
+        self.model_id = model_id or config.MODEL_ID
+        self.schema_info = schema_info
+
+        # 질문과 무관한 고정 지시문 (페르소나 + 스키마 + 규칙, vLLM prefix cache 재사용)
+        self.static_prompt = f"""당신은 질문 분석, 질문 분류, SQL 작성을 한 번에 수행하는 전문가입니다.
+맨 아래의 사용자 질문을 분석하고, 도메인 데이터 검색이 필요한지 판단한 뒤, 필요하면 SQL 쿼리를 생성하세요.
+
+**도메인 데이터란?**
+- 데이터베이스에 저장된 비즈니스 데이터
+- 통계, 집계, 조회가 필요한 데이터
+
+**데이터베이스 스키마:**
+{self.schema_info}
+
+다음 JSON 형식으로 응답하세요:
+{{
+    "entities": {{
+        "category": "카테고리명 (없으면 null)",
+        "item_type": "항목 유형 (없으면 null)",
+        "region": "지역명 (없으면 null)",
+        "year": 연도 숫자 (예: 2025, 없으면 null),
+        "month": 월 숫자 (예: 7, 없으면 null)
+    }},
+    "requires_rag": true 또는 false (도메인 관련이고 데이터 검색이 필요하면 true),
+    "main_sql": "메인 SQL 쿼리 (SELECT ... FROM your_table ...), requires_rag가 false이면 null",
+    "total_count_sql": "총 개수 조회 SQL (그룹핑인 경우만, 없으면 null)",
+    "query_type": "aggregation|count|lookup"
+}}
+
+**판단 기준:**
+1. 데이터 조회/통계가 필요한 질문이면 RAG 필요
+2. 일반 인사말, 날씨, 계산, 일반 대화 등은 도메인 무관
+
+**SQL 작성 규칙**:
+1. **LIMIT 자동 결정**:
+   - "상위 N개", "top N" → LIMIT N
+   - "전체", "모든", "다" → LIMIT 없음
+   - 통계 질문 기본 → LIMIT 20
+
+2. **GROUP BY 결정**:
+   - 통계/집계 질문 → 적절한 컬럼으로 GROUP BY
+   - 단순 건수 질문 → COUNT(*)
+
+3. **query_type 결정**:
+   - aggregation: 통계/집계 (GROUP BY 사용)
+   - count: 단순 건수 (COUNT만)
+   - lookup: 상세 조회 (개별 레코드)
+
+4. **SELECT 컬럼**:
+   - SELECT * 대신 답변에 필요한 컬럼만 명시
+   - aggregation/count 쿼리에서는 id, keywords, text 컬럼을 선택하지 않음
+
+**중요**: 오직 JSON만 출력하세요. SQL은 반드시 문자열로 작성."""
+
+    async def plan(self, query: str) -> Plan:
+        """
+        질문에 대한 RAG 판단과 SQL 계획 생성
+
+        Args:
+            query: 사용자 질문
+
+        Returns:
+            Plan 객체
+        """
+        logger.info(f"[Planner] 질의 계획 중: '{query[:50]}...'")
+        prompt = f'{self.static_prompt}\n\n사용자 질문: "{query}"'
+
+        try:
+            result = await post_completion(
+                self.vllm_url,
+                {
+                    "model": self.model_id,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "max_tokens": 320,
+                    "temperature": 0,
+                    "seed": config.LLM_SEED,
+                    "response_format": PLAN_RESPONSE_FORMAT
+                },
+                PlanSchema,
+                timeout=15
+            )
+            data = PlanSchema.model_validate_json(result["choices"][0]["message"]["content"])
+
+        except Exception as e:
+            logger.error(f"[Planner] 계획 실패 - Fallback 사용: {e}")
+            analysis = fallback_analysis(query)
+            decision = fallback_decision(analysis)
+            return Plan(requires_rag=decision.requires_rag, entities=analysis.entities, fallback=True)
+
+        if not data.requires_rag:
+            return Plan(requires_rag=False, entities=data.entities.model_dump())
+
+        return Plan(
+            requires_rag=True,
+            entities=data.entities.model_dump(),
+            main_sql=data.main_sql or None,
+            total_count_sql=data.total_count_sql or None,
+            query_type=data.query_type
+        )
+
+
+# ==================== 전역 인스턴스 ====================
+
+_planner: Optional[PlannerLLM] = None
+_planner_lock = asyncio.Lock()
+
+
+async def get_planner() -> PlannerLLM:
+    """싱글톤 플래너 인스턴스 반환"""
+    global _planner
+    async with _planner_lock:
+        if _planner is None:
+            sql_service = await get_sql_service()
+            _planner = PlannerLLM(schema_info=sql_service.schema_info)
+    return _planner
@@ -8,11 +8,15 @@ Architecture:
 - Layer 3: RAG Trigger (RAG 실행 - 검색 파라미터 생성)
 """
 
+import asyncio
 import json
-import requests
-from typing import Dict, Any, Optional, Tuple
+import ahocorasick
+import httpx
+from typing import Dict, Any, List, Literal, Optional, Tuple
 from dataclasses import dataclass
+from pydantic import BaseModel
 import logging
+from http_client import json_schema_format, post_completion
 import config
 
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +33,7 @@ class QueryAnalysis:
     keywords: list  # 핵심 키워드
     question_type: str  # 질문 유형 (aggregation, lookup, general)
     confidence: float  # 분석 신뢰도 (0.0 ~ 1.0)
+    fallback: bool = False  # LLM 실패로 키워드 매칭 결과를 사용했는지 여부
 
 
 @dataclass
@@ -38,6 +43,7 @@ class RelevanceDecision:
     requires_rag: bool  # RAG 필요 여부
     confidence: float  # 판단 신뢰도 (0.0 ~ 1.0)
     reason: str  # 판단 이유
+    fallback: bool = False  # LLM 실패로 Layer 1 결과만으로 판단했는지 여부
 
 
 @dataclass
@@ -51,105 +57,186 @@ class RAGConfig:
     metadata_filter: Optional[Dict] = None  # 메타데이터 필터
 
 
-# ==================== Layer 1: Query Analysis ====================
+# ==================== Response Schemas ====================
+# vLLM 구조화 출력(response_format)에 사용할 JSON 스키마
 
-class QueryAnalyzer:
-    """쿼리 분석 레이어 - LLM으로 질문의 의도와 엔티티 추출"""
+class EntitiesSchema(BaseModel):
+    category: Optional[str] = None
+    item_type: Optional[str] = None
+    region: Optional[str] = None
+    year: Optional[int] = None
+    month: Optional[int] = None
 
-    def __init__(self, vllm_url: str = None, model_id: str = None):
-        self.vllm_url = vllm_url or config.VLLM_API_URL
-        self.model_id = model_id or config.MODEL_ID
 
-    def analyze(self, query: str) -> QueryAnalysis:
-        """
-        질문을 분석하여 의도, 엔티티, 키워드 추출
+class QueryAnalysisSchema(BaseModel):
+    intent: str
+    entities: EntitiesSchema
+    keywords: List[str]
+    question_type: Literal["aggregation", "lookup", "general"]
+    confidence: float
 
-        Args:
-            query: 사용자 질문
 
-        Returns:
-            QueryAnalysis 객체
-        """
-        prompt = f"""당신은 질문 분석 전문가입니다. 아래 사용자 질문을 분석하세요.
+class RelevanceDecisionSchema(BaseModel):
+    is_retail_related: bool
+    requires_rag: bool
+    confidence: float
+    reason: str
+
+
+ANALYSIS_RESPONSE_FORMAT = json_schema_format("query_analysis", QueryAnalysisSchema)
+DECISION_RESPONSE_FORMAT = json_schema_format("relevance_decision", RelevanceDecisionSchema)
+
+
+def _to_query_analysis(data: QueryAnalysisSchema) -> QueryAnalysis:
+    return QueryAnalysis(
+        intent=data.intent,
+        entities=data.entities.model_dump(),
+        keywords=data.keywords,
+        question_type=data.question_type,
+        confidence=data.confidence
+    )
+
+
+def _to_relevance_decision(data: RelevanceDecisionSchema) -> RelevanceDecision:
+    return RelevanceDecision(
+        is_retail_related=data.is_retail_related,
+        requires_rag=data.requires_rag,
+        confidence=data.confidence,
+        reason=data.reason
+    )
+
+
+# ==================== Layer 1: Query Analysis ====================
+
+# Fallback 판단용 데이터 키워드 (모듈 로드 시 Aho-Corasick 오토마톤으로 한 번만 컴파일)
+DATA_KEYWORDS = ["통계", "데이터", "조회", "검색", "목록", "내역"]
+
+_DATA_KEYWORD_AUTOMATON = ahocorasick.Automaton()
+for _keyword in DATA_KEYWORDS:
+    _DATA_KEYWORD_AUTOMATON.add_word(_keyword, _keyword)
+_DATA_KEYWORD_AUTOMATON.make_automaton()
 
-사용자 질문: "{query}"
+# 질문과 무관한 고정 지시문 (호출마다 같은 바이트 → vLLM prefix cache 적중)
+ANALYSIS_PROMPT = """당신은 질문 분석 전문가입니다. 맨 아래의 사용자 질문을 분석하세요.
 
 다음 정보를 JSON 형식으로 추출하세요:
-{{
+{
     "intent": "질문의 주요 의도 (예: 데이터통계, 항목조회, 일반대화, 기술질문 등)",
-    "entities": {{
+    "entities": {
         "category": "카테고리명 (없으면 null)",
         "item_type": "항목 유형 (없으면 null)",
         "region": "지역명 (없으면 null)",
         "year": 연도 숫자 (예: 2025, 없으면 null),
         "month": 월 숫자 (예: 7, 없으면 null)
-    }},
+    },
     "keywords": ["핵심", "키워드", "리스트"],
     "question_type": "aggregation (통계/집계) | lookup (조회/검색) | general (일반대화)",
     "confidence": 0.0에서 1.0 사이의 분석 신뢰도
-}}
+}
 
 **중요**: 오직 JSON만 출력하세요. 다른 설명은 불필요합니다."""
 
+
+def fallback_analysis(query: str) -> QueryAnalysis:
+    """LLM 실패 시 간단한 키워드 매칭으로 대체"""
+    keywords = list(dict.fromkeys(kw for _, kw in _DATA_KEYWORD_AUTOMATON.iter(query)))
+
+    return QueryAnalysis(
+        intent="unknown",
+        entities={},
+        keywords=keywords,
+        question_type="general",
+        confidence=0.3,
+        fallback=True
+    )
+
+
+class QueryAnalyzer:
+    """쿼리 분석 레이어 - LLM으로 질문의 의도와 엔티티 추출"""
+
+    def __init__(self, vllm_url: str = None, model_id: str = None):
+        self.vllm_url = vllm_url or config.VLLM_API_URL
+        self.model_id = model_id or config.MODEL_ID
+
+    async def analyze(self, query: str) -> QueryAnalysis:
+        """
+        질문을 분석하여 의도, 엔티티, 키워드 추출
+
+        Args:
+            query: 사용자 질문
+
+        Returns:
+            QueryAnalysis 객체
+        """
+        # 고정 지시문을 앞에, 질문을 맨 뒤에 배치 (vLLM prefix cache 재사용)
+        prompt = f'{ANALYSIS_PROMPT}\n\n사용자 질문: "{query}"'
+
         try:
-            response = requests.post(
+            result = await post_completion(
                 self.vllm_url,
-                json={
+                {
                     "model": self.model_id,
                     "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 300,
-                    "temperature": 0.1
+                    "max_tokens": 128,
+                    "temperature": 0,
+                    "seed": config.LLM_SEED,
+                    "response_format": ANALYSIS_RESPONSE_FORMAT
                 },
+                QueryAnalysisSchema,
                 timeout=10
             )
-            response.raise_for_status()
-
-            result = response.json()
             content = result["choices"][0]["message"]["content"]
 
-            # JSON 파싱
-            content = content.strip()
-            if content.startswith("```json"):
-                content = content[7:]
-            if content.startswith("```"):
-                content = content[3:]
-            if content.endswith("```"):
-                content = content[:-3]
-            content = content.strip()
-
-            data = json.loads(content)
-
-            return QueryAnalysis(
-                intent=data.get("intent", "unknown"),
-                entities=data.get("entities", {}),
-                keywords=data.get("keywords", []),
-                question_type=data.get("question_type", "general"),
-                confidence=float(data.get("confidence", 0.5))
-            )
+            return _to_query_analysis(QueryAnalysisSchema.model_validate_json(content))
 
-        except requests.exceptions.Timeout:
+        except httpx.TimeoutException:
             logger.warning("Layer 1 타임아웃 - 기본값 반환")
-            return self._fallback_analysis(query)
+            return fallback_analysis(query)
         except Exception as e:
             logger.error(f"Layer 1 분석 실패: {e}")
-            return self._fallback_analysis(query)
-
-    def _fallback_analysis(self, query: str) -> QueryAnalysis:
-        """LLM 실패 시 간단한 키워드 매칭으로 대체"""
-        data_keywords = ["통계", "데이터", "조회", "검색", "목록", "내역"]
-        keywords = [kw for kw in data_keywords if kw in query]
-
-        return QueryAnalysis(
-            intent="unknown",
-            entities={},
-            keywords=keywords,
-            question_type="general",
-            confidence=0.3
-        )
+            return fallback_analysis(query)
 
 
 # ==================== Layer 2: Relevance Decision ====================
 
+# 질문과 무관한 고정 지시문
+DECISION_PROMPT = """당신은 질문 분류 전문가입니다. 맨 아래에 주어진 질문이 "도메인 데이터"와 관련이 있는지 판단하세요.
+
+**도메인 데이터란?**
+- 데이터베이스에 저장된 비즈니스 데이터
+- 통계, 집계, 조회가 필요한 데이터
+
+아래 JSON 형식으로 판단하세요:
+{
+    "is_retail_related": true 또는 false,
+    "requires_rag": true 또는 false (도메인 관련이고 데이터 검색이 필요하면 true),
+    "confidence": 0.0에서 1.0 사이의 신뢰도,
+    "reason": "판단 이유를 한 문장으로"
+}
+
+**판단 기준:**
+1. 데이터 조회/통계가 필요한 질문이면 RAG 필요
+2. 일반 인사말, 날씨, 계산, 일반 대화 등은 도메인 무관
+
+**중요**: 오직 JSON만 출력하세요."""
+
+
+def fallback_decision(analysis: QueryAnalysis) -> RelevanceDecision:
+    """LLM 실패 시 Layer 1 결과로 간단 판단"""
+    related = (
+        analysis.question_type in ["aggregation", "lookup"] and
+        len(analysis.keywords) > 0
+    )
+
+    return RelevanceDecision(
+        is_retail_related=related,
+        requires_rag=related,
+        confidence=0.5,
+        reason="Fallback decision based on keywords",
+        fallback=True
+    )
+
+
 class RelevanceDecider:
     """관련성 판단 레이어 - Layer 1 결과를 바탕으로 RAG 필요 여부 결정"""
 
@@ -157,7 +244,7 @@ class RelevanceDecider:
         self.vllm_url = vllm_url or config.VLLM_API_URL
         self.model_id = model_id or config.MODEL_ID
 
-    def decide(self, query: str, analysis: QueryAnalysis) -> RelevanceDecision:
+    async def decide(self, query: str, analysis: QueryAnalysis) -> RelevanceDecision:
         """
         Layer 1 결과를 바탕으로 RAG 필요 여부 판단
 
@@ -168,11 +255,8 @@ class RelevanceDecider:
         Returns:
             RelevanceDecision 객체
         """
-        prompt = f"""당신은 질문 분류 전문가입니다. 주어진 질문이 "도메인 데이터"와 관련이 있는지 판단하세요.
-
-**도메인 데이터란?**
-- 데이터베이스에 저장된 비즈니스 데이터
-- 통계, 집계, 조회가 필요한 데이터
+        # 고정 지시문을 앞에, 질문과 Layer 1 결과를 맨 뒤에 배치 (vLLM prefix cache 재사용)
+        prompt = f"""{DECISION_PROMPT}
 
 **사용자 질문:**
 "{query}"
@@ -181,74 +265,29 @@ class RelevanceDecider:
 - 의도: {analysis.intent}
 - 엔티티: {json.dumps(analysis.entities, ensure_ascii=False)}
 - 키워드: {analysis.keywords}
-- 질문 유형: {analysis.question_type}
-
-아래 JSON 형식으로 판단하세요:
-{{
-    "is_retail_related": true 또는 false,
-    "requires_rag": true 또는 false (도메인 관련이고 데이터 검색이 필요하면 true),
-    "confidence": 0.0에서 1.0 사이의 신뢰도,
-    "reason": "판단 이유를 한 문장으로"
-}}
-
-**판단 기준:**
-1. 데이터 조회/통계가 필요한 질문이면 RAG 필요
-2. 일반 인사말, 날씨, 계산, 일반 대화 등은 도메인 무관
-
-**중요**: 오직 JSON만 출력하세요."""
+- 질문 유형: {analysis.question_type}"""
 
         try:
-            response = requests.post(
+            result = await post_completion(
                 self.vllm_url,
-                json={
+                {
                     "model": self.model_id,
                     "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 200,
-                    "temperature": 0.1
+                    "max_tokens": 96,
+                    "temperature": 0,
+                    "seed": config.LLM_SEED,
+                    "response_format": DECISION_RESPONSE_FORMAT
                 },
+                RelevanceDecisionSchema,
                 timeout=10
             )
-            response.raise_for_status()
-
-            result = response.json()
             content = result["choices"][0]["message"]["content"]
 
-            # JSON 파싱
-            content = content.strip()
-            if content.startswith("```json"):
-                content = content[7:]
-            if content.startswith("```"):
-                content = content[3:]
-            if content.endswith("```"):
-                content = content[:-3]
-            content = content.strip()
-
-            data = json.loads(content)
-
-            return RelevanceDecision(
-                is_retail_related=data.get("is_retail_related", False),
-                requires_rag=data.get("requires_rag", False),
-                confidence=float(data.get("confidence", 0.5)),
-                reason=data.get("reason", "")
-            )
+            return _to_relevance_decision(RelevanceDecisionSchema.model_validate_json(content))
 
         except Exception as e:
             logger.error(f"Layer 2 판단 실패: {e}")
-            return self._fallback_decision(analysis)
-
-    def _fallback_decision(self, analysis: QueryAnalysis) -> RelevanceDecision:
-        """LLM 실패 시 Layer 1 결과로 간단 판단"""
-        related = (
-            analysis.question_type in ["aggregation", "lookup"] and
-            len(analysis.keywords) > 0
-        )
-
-        return RelevanceDecision(
-            is_retail_related=related,
-            requires_rag=related,
-            confidence=0.5,
-            reason="Fallback decision based on keywords"
-        )
+            return fallback_decision(analysis)
 
 
 # ==================== Layer 3: RAG Trigger ====================
@@ -335,7 +374,7 @@ class LLMQueryClassifier:
         self.decider = RelevanceDecider()
         self.trigger = RAGTrigger()
 
-    def classify(self, query: str) -> Tuple[bool, RAGConfig, Dict[str, Any]]:
+    async def classify(self, query: str) -> Tuple[bool, RAGConfig, Dict[str, Any]]:
         """
         질문을 3-layer로 분석하여 RAG 사용 여부 결정
 
@@ -347,68 +386,80 @@ class LLMQueryClassifier:
         """
         # Layer 1: Query Analysis
         logger.info(f"[Layer 1] 질문 분석 중: '{query[:50]}...'")
-        analysis = self.analyzer.analyze(query)
+        analysis = await self.analyzer.analyze(query)
 
         # Layer 2: Relevance Decision
         logger.info(f"[Layer 2] 관련성 판단 중...")
-        decision = self.decider.decide(query, analysis)
+        decision = await self.decider.decide(query, analysis)
 
         # Layer 3: RAG Trigger
         logger.info(f"[Layer 3] RAG 설정 생성 중...")
         rag_config = self.trigger.generate_config(query, analysis, decision)
 
-        # 디버그 정보
-        debug_info = {
-            "layer1_analysis": {
-                "intent": analysis.intent,
-                "entities": analysis.entities,
-                "keywords": analysis.keywords,
-                "question_type": analysis.question_type,
-                "confidence": analysis.confidence
-            },
-            "layer2_decision": {
-                "is_retail_related": decision.is_retail_related,
-                "requires_rag": decision.requires_rag,
-                "confidence": decision.confidence,
-                "reason": decision.reason
-            },
-            "layer3_config": {
-                "use_rag": rag_config.use_rag,
-                "top_k": rag_config.top_k,
-                "score_threshold": rag_config.score_threshold,
-                "search_query": rag_config.search_query
-            }
-        }
+        debug_info = build_debug_info(analysis, decision, rag_config)
 
         return rag_config.use_rag, rag_config, debug_info
 
 
+def build_debug_info(
+    analysis: QueryAnalysis,
+    decision: RelevanceDecision,
+    rag_config: RAGConfig
+) -> Dict[str, Any]:
+    """각 Layer 결과를 디버그 정보 딕셔너리로 변환"""
+    return {
+        "fallback": analysis.fallback or decision.fallback,
+        "layer1_analysis": {
+            "intent": analysis.intent,
+            "entities": analysis.entities,
+            "keywords": analysis.keywords,
+            "question_type": analysis.question_type,
+            "confidence": analysis.confidence
+        },
+        "layer2_decision": {
+            "is_retail_related": decision.is_retail_related,
+            "requires_rag": decision.requires_rag,
+            "confidence": decision.confidence,
+            "reason": decision.reason
+        },
+        "layer3_config": {
+            "use_rag": rag_config.use_rag,
+            "top_k": rag_config.top_k,
+            "score_threshold": rag_config.score_threshold,
+            "search_query": rag_config.search_query
+        }
+    }
+
+
 # ==================== 전역 인스턴스 ====================
 
 _classifier: Optional[LLMQueryClassifier] = None
+_classifier_lock = asyncio.Lock()
 
 
-def get_classifier() -> LLMQueryClassifier:
+async def get_classifier() -> LLMQueryClassifier:
     """싱글톤 분류기 인스턴스 반환"""
     global _classifier
-    if _classifier is None:
-        _classifier = LLMQueryClassifier()
+    async with _classifier_lock:
+        if _classifier is None:
+            _classifier = LLMQueryClassifier()
     return _classifier
 
 
 # ==================== 기존 API 호환성 유지 ====================
+# 분류가 비동기로 바뀌어 이름에 _async를 붙임 (동기 호출부가 코루틴 객체를 bool로 쓰지 않도록)
 
-def should_use_rag(query: str, threshold: float = 0.3) -> bool:
-    """RAG 사용 여부 판단 (기존 API 호환)"""
-    classifier = get_classifier()
-    use_rag, _, _ = classifier.classify(query)
+async def should_use_rag_async(query: str, threshold: float = 0.3) -> bool:
+    """RAG 사용 여부 판단 (기존 should_use_rag의 비동기 버전, await 필요)"""
+    classifier = await get_classifier()
+    use_rag, _, _ = await classifier.classify(query)
     return use_rag
 
 
-def is_retail_related(query: str) -> Tuple[bool, float]:
-    """도메인 관련 여부 판단 (기존 API 호환)"""
-    classifier = get_classifier()
-    _, _, debug_info = classifier.classify(query)
+async def is_retail_related_async(query: str) -> Tuple[bool, float]:
+    """도메인 관련 여부 판단 (기존 is_retail_related의 비동기 버전, await 필요)"""
+    classifier = await get_classifier()
+    _, _, debug_info = await classifier.classify(query)
     is_related = debug_info["layer2_decision"]["is_retail_related"]
     confidence = debug_info["layer2_decision"]["confidence"]
     return is_related, confidence
@@ -0,0 +1,290 @@
+"""
+RAG 컨텍스트 캐시 모듈
+동일하거나 거의 같은 질문에 대해 질문 분류 + SQL 검색 결과를 재사용합니다.
+
+Architecture:
+- Exact Tier: 정렬된 단어 토큰 해시 → 결과 (어순/문장부호만 다른 질문도 적중, Redis 공유 캐시)
+- Semantic Tier: 임베딩 LSH 버킷 → 코사인 유사도 게이트 (기본 0.95 이상) + 숫자 토큰 일치
+  (RAG 미사용 결과만 저장, SQL 결과는 임베딩으로 구분할 수 없어 Exact Tier에서만 재사용)
+- Invalidation: SQLite 파일(+ WAL)의 st_mtime이 바뀌면 전체 캐시 비움
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from cachetools import TTLCache
+from shared_cache import SharedCache
+from sql_service import db_file_version
+import config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# ==================== Data Classes ====================
+
+@dataclass
+class RAGResult:
+    """process_query 결과 (캐시 저장 단위)"""
+    rag_context: str  # LLM에 전달할 검색 컨텍스트
+    use_rag_decision: bool  # RAG 사용 여부 판단 결과
+    entities: Dict[str, Any] = field(default_factory=dict)  # 추출된 엔티티
+    cacheable: bool = True  # 오류 등으로 재사용하면 안 되는 결과는 False
+
+
+# ==================== Semantic Tier ====================
+
+_WORD_RE = re.compile(r"\w+")
+_DIGIT_RE = re.compile(r"\d+")
+
+
+class QueryTokens(NamedTuple):
+    """유사 질문 재사용 가드용 토큰 (임베딩만으로는 "7월 서울"과 "8월 부산"을 구분하지 못함)"""
+    digits: Tuple[str, ...]  # 등장 순서대로의 숫자 토큰 (연도, 월, 상위 N 등)
+    words: FrozenSet[str]  # 소문자 단어 토큰 집합 (지역, 카테고리 등 엔티티 포함)
+
+    @classmethod
+    def of(cls, query: str) -> "QueryTokens":
+        normalized = query.strip().lower()
+        return cls(tuple(_DIGIT_RE.findall(normalized)), frozenset(_WORD_RE.findall(normalized)))
+
+    def allows(self, other: "QueryTokens") -> bool:
+        """코사인 게이트를 통과한 후보를 재사용해도 되는지 확인 (숫자 토큰이 같아야 함)"""
+        return self.digits == other.digits
+
+
+class SemanticIndex:
+    """랜덤 초평면 LSH 기반 유사 질문 인덱스 (128-bit 시그니처, 16-bit 밴드)"""
+
+    def __init__(
+        self,
+        dim: int,
+        maxsize: int,
+        ttl: float,
+        threshold: float,
+        n_bits: int = 128,
+        band_bits: int = 16,
+        seed: int = 0
+    ):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((dim, n_bits)).astype(np.float32)
+        self.n_bands = n_bits // band_bits
+        self.band_bits = band_bits
+        self.threshold = threshold
+        self.maxsize = maxsize
+
+        # key -> (scope, 정규화된 임베딩, 결과, 질문 토큰)
+        self.entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        # (밴드 번호, 밴드 값) -> key 목록
+        self.buckets: Dict[Tuple[int, int], List[str]] = {}
+        self._bucket_size = 0
+
+    def _bands(self, embedding: np.ndarray) -> List[Tuple[int, int]]:
+        """임베딩을 128-bit 시그니처로 변환 후 밴드 단위로 분할"""
+        bits = (embedding @ self.planes) > 0
+        bands = bits.reshape(self.n_bands, self.band_bits)
+        weights = 1 << np.arange(self.band_bits)
+        return [(i, int(value)) for i, value in enumerate(bands @ weights)]
+
+    def lookup(self, embedding: np.ndarray, scope: str, tokens: QueryTokens) -> Optional[RAGResult]:
+        """같은 버킷에서 토큰 가드를 통과한 후보 중 top-1을 찾고 코사인 유사도 게이트 통과 시 반환"""
+        best_score = -1.0
+        best_result = None
+        seen = set()
+
+        for band in self._bands(embedding):
+            for key in self.buckets.get(band, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+
+                entry = self.entries.get(key)
+                if entry is None or entry[0] != scope or not tokens.allows(entry[3]):
+                    continue
+
+                score = float(np.dot(embedding, entry[1]))
+                if score > best_score:
+                    best_score = score
+                    best_result = entry[2]
+
+        if best_result is not None and best_score >= self.threshold:
+            logger.info(f"의미 캐시 적중 (cosine={best_score:.3f})")
+            return best_result
+        return None
+
+    def add(self, key: str, scope: str, embedding: np.ndarray, result: RAGResult, tokens: QueryTokens):
+        """인덱스에 결과 추가"""
+        self.entries[key] = (scope, embedding, result, tokens)
+        for band in self._bands(embedding):
+            self.buckets.setdefault(band, []).append(key)
+        self._bucket_size += self.n_bands
+
+        # 만료/축출된 key가 버킷에 쌓이면 살아있는 항목만으로 재구성
+        if self._bucket_size > 2 * self.maxsize * self.n_bands:
+            self._rebuild_buckets()
+
+    def _rebuild_buckets(self):
+        self.buckets = {}
+        self._bucket_size = 0
+        for key, (_, embedding, _, _) in list(self.entries.items()):
+            for band in self._bands(embedding):
+                self.buckets.setdefault(band, []).append(key)
+            self._bucket_size += self.n_bands
+
+    def clear(self):
+        self.entries.clear()
+        self.buckets = {}
+        self._bucket_size = 0
+
+
+# ==================== Cached RAG ====================
+
+class CachedRAG:
+    """process_query 앞단의 2-tier 캐시 (exact hash + semantic LSH)"""
+
+    def __init__(
+        self,
+        compute: Callable[[str, Optional[bool], int], Awaitable[RAGResult]],
+        db_path: Optional[str] = None,
+        maxsize: int = None,
+        ttl: float = None,
+        similarity_threshold: float = None,
+        embedding_model: str = None
+    ):
+        self.compute = compute
+        self.db_path = db_path
+        self.maxsize = maxsize or config.RAG_CACHE_MAXSIZE
+        self.ttl = ttl or config.RAG_CACHE_TTL
+        self.similarity_threshold = similarity_threshold or config.RAG_CACHE_SIMILARITY
+        self.embedding_model = embedding_model or config.RAG_CACHE_EMBEDDING_MODEL
+
+        self._exact = SharedCache("rag", maxsize=self.maxsize, ttl=self.ttl)
+        self._semantic: Optional[SemanticIndex] = None
+        self._encoder = None
+        self._encoder_task: Optional[asyncio.Task] = None
+        self._db_mtime = self._stat_db()
+
+    async def __call__(self, user_query: str, use_rag: Optional[bool], top_k: int) -> Tuple[str, bool]:
+        """
+        캐시를 거쳐 RAG 컨텍스트 반환
+
+        Args:
+            user_query: 사용자 질문
+            use_rag: RAG 강제 여부 (None이면 자동 판단)
+            top_k: 검색 결과 수
+
+        Returns:
+            (RAG 컨텍스트, RAG 사용 여부)
+        """
+        # RAG 미사용이 명시된 경우는 캐시할 작업이 없음
+        if not user_query or use_rag is False:
+            result = await self.compute(user_query, use_rag, top_k)
+            return result.rag_context, result.use_rag_decision
+
+        self._check_invalidation()
+
+        scope = f"{use_rag}|{top_k}"
+        tokens = QueryTokens.of(user_query)
+        key = self._make_key(user_query, tokens, scope)
+
+        # Exact Tier
+        cached = await self._exact.get(key)
+        if cached is not None:
+            logger.info("정확 일치 캐시 적중")
+            return cached["rag_context"], cached["use_rag_decision"]
+
+        # Semantic Tier (RAG 미사용 결과만 들어 있으므로 RAG 강제 요청이나 빈 인덱스면 임베딩 생략)
+        embedding = None
+        if use_rag is None and self._semantic is not None and len(self._semantic.entries):
+            embedding = await self._embed(user_query)
+            if embedding is not None:
+                result = self._semantic.lookup(embedding, scope, tokens)
+                if result is not None:
+                    await self._exact.set(key, asdict(result))
+                    return result.rag_context, result.use_rag_decision
+
+        # Cache Miss
+        result = await self.compute(user_query, use_rag, top_k)
+        if result.cacheable:
+            await self._exact.set(key, asdict(result))
+            if not result.use_rag_decision:
+                if embedding is None:
+                    embedding = await self._embed(user_query)
+                if embedding is not None:
+                    self._semantic.add(key, scope, embedding, result, tokens)
+
+        return result.rag_context, result.use_rag_decision
+
+    def bind_db(self, db_path: Optional[str]):
+        """무효화 기준이 될 SQLite 파일 경로 설정"""
+        self.db_path = db_path
+        self._db_mtime = self._stat_db()
+        self.clear()
+
+    def clear(self):
+        """프로세스 내 캐시 비우기 (공유 캐시 항목은 키에 포함된 DB 버전으로 무효화)"""
+        self._exact.clear_local()
+        if self._semantic is not None:
+            self._semantic.clear()
+
+    def _make_key(self, query: str, tokens: QueryTokens, scope: str) -> str:
+        # 단어 토큰을 정렬해 키로 사용 (어순/문장부호만 다른 질문은 같은 키, 단어가 없으면 원문)
+        normalized = " ".join(sorted(tokens.words)) or query.strip().lower()
+        raw = f"{self._db_mtime}\x00{scope}\x00{normalized}"
+        return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+    def _stat_db(self) -> Optional[Tuple[int, int]]:
+        if not self.db_path:
+            return None
+        return db_file_version(self.db_path)
+
+    def _check_invalidation(self):
+        """DB 파일이 변경되었으면 캐시 무효화"""
+        mtime = self._stat_db()
+        if mtime != self._db_mtime:
+            logger.info("DB 변경 감지 - RAG 캐시 초기화")
+            self._db_mtime = mtime
+            self.clear()
+
+    def start_encoder(self):
+        """임베딩 모델을 백그라운드에서 로드 (startup에서 호출, 로드 완료 전까지 Semantic Tier는 건너뜀)"""
+        if self._encoder is None and self._encoder_task is None:
+            self._encoder_task = asyncio.create_task(self._load_encoder_in_background())
+
+    async def _load_encoder_in_background(self):
+        try:
+            self._encoder = await asyncio.to_thread(self._load_encoder)
+        except Exception as e:
+            logger.warning(f"임베딩 모델 로드 실패 - 의미 캐시 비활성화: {e}")
+
+    async def _embed(self, query: str) -> Optional[np.ndarray]:
+        """질문 임베딩 계산 (인코더 미로드/로드 실패/인코딩 실패 시 None → Semantic Tier 건너뜀)"""
+        if self._encoder is None:
+            return None
+
+        try:
+            embedding = await asyncio.to_thread(
+                self._encoder.encode, query.strip(), normalize_embeddings=True
+            )
+        except Exception as e:
+            logger.warning(f"질문 임베딩 실패 - 의미 캐시 건너뜀: {e}")
+            return None
+        return np.asarray(embedding, dtype=np.float32)
+
+    def _load_encoder(self):
+        from sentence_transformers import SentenceTransformer
+
+        encoder = SentenceTransformer(self.embedding_model)
+        self._semantic = SemanticIndex(
+            dim=encoder.get_sentence_embedding_dimension(),
+            maxsize=self.maxsize,
+            ttl=self.ttl,
+            threshold=self.similarity_threshold
+        )
+        logger.info(f"임베딩 모델 로드 완료: {self.embedding_model}")
+        return encoder
@@ -0,0 +1,153 @@
+"""
+공유 캐시 모듈
+여러 Uvicorn 워커 프로세스가 같은 캐시를 보도록 Redis를 백엔드로 사용합니다.
+
+- config.REDIS_URL이 설정되어 있으면 Redis에 `SET ... EX ttl`로 저장 (값은 orjson 직렬화)
+- REDIS_URL이 None이거나 Redis 오류 시 프로세스 내 TTLCache로 대체
+- Redis 오류가 나면 REDIS_RETRY_INTERVAL 동안 Redis 호출을 건너뜀 (장애 중 요청마다 타임아웃 대기 방지)
+- 무효화는 호출 측에서 키에 DB 버전을 포함하는 방식으로 처리 (워커 간 별도 삭제 불필요)
+- 스트리밍 중단 플래그도 같은 Redis로 공유 (중단 요청이 다른 워커로 가도 적용)
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Optional
+
+import orjson
+import redis.asyncio as redis
+from cachetools import TTLCache
+import config
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REDIS: Optional[redis.Redis] = (
+    redis.Redis.from_url(
+        config.REDIS_URL,
+        socket_timeout=config.REDIS_TIMEOUT,
+        socket_connect_timeout=config.REDIS_TIMEOUT
+    )
+    if config.REDIS_URL else None
+)
+
+# Redis 오류 후 다시 시도할 시각 (time.monotonic 기준)
+_redis_retry_at = 0.0
+
+
+def _redis() -> Optional[redis.Redis]:
+    """사용 가능한 Redis 클라이언트 반환 (미설정이거나 오류 후 대기 중이면 None)"""
+    if REDIS is None or time.monotonic() < _redis_retry_at:
+        return None
+    return REDIS
+
+
+def _redis_failed(action: str, error: Exception):
+    """Redis 오류 기록 후 REDIS_RETRY_INTERVAL 동안 Redis 호출 중단"""
+    global _redis_retry_at
+    _redis_retry_at = time.monotonic() + config.REDIS_RETRY_INTERVAL
+    logger.warning(f"Redis {action} 실패 - {config.REDIS_RETRY_INTERVAL}초간 Redis 사용 중단: {error}")
+
+
+class SharedCache:
+    """네임스페이스 단위 공유 캐시 (Redis 우선, 실패 시 로컬 TTLCache)"""
+
+    def __init__(self, namespace: str, maxsize: int, ttl: float):
+        self.namespace = namespace
+        self.ttl = int(ttl)
+        self._local: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _redis_key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: str) -> Optional[Any]:
+        """캐시 조회 (Redis에 없으면 로컬 캐시 확인, 둘 다 없으면 None)"""
+        client = _redis()
+        if client is not None:
+            try:
+                raw = await client.get(self._redis_key(key))
+                if raw is not None:
+                    return orjson.loads(raw)
+            except redis.RedisError as e:
+                _redis_failed("조회", e)
+        return self._local.get(key)
+
+    async def set(self, key: str, value: Any):
+        """캐시 저장 (Redis 저장 실패 또는 직렬화 불가 값은 로컬에만 저장)"""
+        client = _redis()
+        if client is not None:
+            try:
+                await client.set(self._redis_key(key), orjson.dumps(value), ex=self.ttl)
+                return
+            except redis.RedisError as e:
+                _redis_failed("저장", e)
+            except orjson.JSONEncodeError as e:
+                logger.warning(f"Redis 저장 불가 값 - 로컬 캐시 사용: {e}")
+        self._local[key] = value
+
+    def clear_local(self):
+        """프로세스 내 캐시 비우기 (Redis 항목은 키의 DB 버전으로 자연 무효화)"""
+        self._local.clear()
+
+
+# 진행 중인 스트리밍 요청의 중단 플래그 (멀티 워커에서 /api/chat/stop이 다른 워커로 가는 경우용)
+_STOP_PREFIX = "chat:stop:"
+_STOP_TTL = 600  # 최대 스트리밍 시간 이상
+
+
+async def register_stream(request_id: str):
+    """스트리밍 시작 시 중단 플래그 키 생성 (Redis 미사용 시 무시)"""
+    client = _redis()
+    if client is None:
+        return
+    try:
+        await client.set(_STOP_PREFIX + request_id, b"0", ex=_STOP_TTL)
+    except redis.RedisError as e:
+        _redis_failed("중단 플래그 등록", e)
+
+
+async def request_stop(request_id: str) -> bool:
+    """다른 워커에서 진행 중인 요청에 중단 표시 (해당 요청이 없으면 False)"""
+    client = _redis()
+    if client is None:
+        return False
+    try:
+        # xx=True: 등록된 요청에만 설정되므로 반환값으로 존재 여부 확인
+        return bool(await client.set(_STOP_PREFIX + request_id, b"1", ex=_STOP_TTL, xx=True))
+    except redis.RedisError as e:
+        _redis_failed("중단 요청", e)
+        return False
+
+
+async def watch_stop(request_id: str, stop_event: asyncio.Event, interval: float):
+    """interval마다 중단 플래그를 확인해 stop_event에 반영 (Redis 미사용 시 즉시 종료, 장애 중에는 건너뜀)"""
+    if REDIS is None:
+        return
+    key = _STOP_PREFIX + request_id
+    while not stop_event.is_set():
+        await asyncio.sleep(interval)
+        client = _redis()
+        if client is None:
+            continue
+        try:
+            if await client.get(key) == b"1":
+                stop_event.set()
+        except redis.RedisError as e:
+            _redis_failed("중단 플래그 조회", e)
+
+
+async def unregister_stream(request_id: str):
+    """스트리밍 종료 시 중단 플래그 키 삭제"""
+    client = _redis()
+    if client is None:
+        return
+    try:
+        await client.delete(_STOP_PREFIX + request_id)
+    except redis.RedisError as e:
+        _redis_failed("중단 플래그 삭제", e)
+
+
+async def close_redis():
+    """서버 종료 시 Redis 연결 정리"""
+    if REDIS is not None:
+        await REDIS.aclose()
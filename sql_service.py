@@ -7,28 +7,171 @@ LLM을 활용하여 자연어를 SQL 쿼리로 변환하고 실행
 2. get_sql_service(db_path="your_data.db")로 서비스 초기화
 """
 
+import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import os
+import queue
 import sqlite3
+import threading
 import json
-import requests
 import logging
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, Iterator, List, Literal, NamedTuple, Optional, Tuple, Any
+from pydantic import BaseModel
+import sqlglot
+from sqlglot import exp
+from http_client import json_schema_format, post_completion
+from shared_cache import SharedCache
 import config
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 허용하는 최상위 구문 (SELECT 및 UNION/INTERSECT/EXCEPT)
+_ALLOWED_ROOTS = (exp.Select, exp.Union)
+
+# 쿼리 어디에도 나타나면 안 되는 DML/DDL 노드
+_FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Merge,
+    exp.Create, exp.Drop, exp.Command, exp.Pragma,
+)
+
+
+class QueryResult(NamedTuple):
+    """SQL 실행 결과 (컬럼명 1회 + 튜플 행, 행마다 dict를 만들지 않음)"""
+    columns: Tuple[str, ...]
+    rows: List[Tuple[Any, ...]]
+
+    def first_value(self, *names: str) -> Any:
+        """첫 행에서 주어진 컬럼명 중 처음 존재하는 컬럼의 값 반환 (없으면 None)"""
+        if not self.rows:
+            return None
+        for name in names:
+            if name in self.columns:
+                return self.rows[0][self.columns.index(name)]
+        return None
+
+
+class SQLPlanSchema(BaseModel):
+    """SQL 생성 응답 스키마 (vLLM 구조화 출력용)"""
+    main_sql: str
+    total_count_sql: Optional[str] = None
+    query_type: Literal["aggregation", "count", "lookup"]
+
+
+SQL_PLAN_RESPONSE_FORMAT = json_schema_format("sql_plan", SQLPlanSchema)
+
+
+def db_file_version(db_path: str) -> Optional[Tuple[int, int]]:
+    """
+    DB 변경 감지용 버전 값 (본 파일 + WAL 파일의 st_mtime_ns)
+
+    WAL 모드에서는 체크포인트 전까지 변경이 -wal 파일에만 기록되므로 둘 다 확인합니다.
+    """
+    try:
+        main_mtime = os.stat(db_path).st_mtime_ns
+    except OSError:
+        return None
+    try:
+        wal_mtime = os.stat(db_path + "-wal").st_mtime_ns
+    except OSError:
+        wal_mtime = 0
+    return main_mtime, wal_mtime
+
+
+@functools.lru_cache(maxsize=512)
+def parse_select_sql(sql: str) -> exp.Expression:
+    """
+    SQL을 파싱하여 단일 SELECT 문인지 검증 (같은 SQL은 캐시된 결과 재사용)
+
+    Args:
+        sql: 검증할 SQL 문자열
+
+    Returns:
+        파싱된 SQL 식
+
+    Raises:
+        ValueError: 파싱 실패, 다중 구문, SELECT 외 구문 포함 시
+    """
+    try:
+        statements = [stmt for stmt in sqlglot.parse(sql, read="sqlite") if stmt is not None]
+    except sqlglot.errors.SqlglotError as e:
+        raise ValueError(f"SQL 파싱 실패: {e}")
+
+    if len(statements) != 1:
+        raise ValueError("하나의 SQL 문만 허용됩니다")
+
+    expression = statements[0]
+    if not isinstance(expression, _ALLOWED_ROOTS):
+        raise ValueError("SELECT 쿼리만 허용됩니다")
+
+    for node in expression.find_all(*_FORBIDDEN_NODES):
+        raise ValueError(f"위험한 SQL 구문 감지: {node.key.upper()}")
+
+    return expression
+
 
 class SQLService:
     """SQL 기반 검색 및 통계 서비스"""
 
-    def __init__(self, db_path: str = "your_data.db"):
+    def __init__(self, db_path: str = "your_data.db", pool_size: int = None):
         self.db_path = db_path
         self.vllm_url = config.VLLM_API_URL
         self.model_id = config.MODEL_ID
 
+        # SQLite 연결 풀 (필요할 때 최대 pool_size개까지 생성 후 재사용)
+        self.pool_size = pool_size or config.SQL_POOL_SIZE
+        self._pool: queue.SimpleQueue = queue.SimpleQueue()
+        self._pool_lock = threading.Lock()
+        self._pool_created = 0
+
+        # 쿼리 전용 스레드 풀 (연결 수와 같은 크기라 연결 대기로 기본 executor 스레드를 막지 않음)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.pool_size, thread_name_prefix="sqlite"
+        )
+
+        # SQL 결과 캐시 (DB 버전 + SQL 문자열 → 결과, 워커 간 Redis로 공유)
+        self._sql_cache = SharedCache("sql", maxsize=config.SQL_CACHE_MAXSIZE, ttl=config.SQL_CACHE_TTL)
+        self._db_version = db_file_version(self.db_path)
+        self._watcher: Optional[asyncio.Task] = None
+
         # DB 스키마 정보
         self.schema_info = self._get_schema_info()
 
+        # SQL 생성 프롬프트의 고정 접두부 (페르소나 + 스키마 + 규칙, 호출마다 같은 바이트)
+        self._static_sql_prompt_prefix = f"""당신은 SQL 전문가입니다. 맨 아래의 사용자 질문을 분석하여 SQL 쿼리를 생성하세요.
+
+{self.schema_info}
+
+다음 JSON 형식으로 응답하세요:
+{{
+    "main_sql": "메인 SQL 쿼리 (SELECT ... FROM your_table ...)",
+    "total_count_sql": "총 개수 조회 SQL (그룹핑인 경우만, 없으면 null)",
+    "query_type": "aggregation|count|lookup"
+}}
+
+**SQL 작성 규칙**:
+1. **LIMIT 자동 결정**:
+   - "상위 N개", "top N" → LIMIT N
+   - "전체", "모든", "다" → LIMIT 없음
+   - 통계 질문 기본 → LIMIT 20
+
+2. **GROUP BY 결정**:
+   - 통계/집계 질문 → 적절한 컬럼으로 GROUP BY
+   - 단순 건수 질문 → COUNT(*)
+
+3. **query_type 결정**:
+   - aggregation: 통계/집계 (GROUP BY 사용)
+   - count: 단순 건수 (COUNT만)
+   - lookup: 상세 조회 (개별 레코드)
+
+4. **SELECT 컬럼**:
+   - SELECT * 대신 답변에 필요한 컬럼만 명시
+   - aggregation/count 쿼리에서는 id, keywords, text 컬럼을 선택하지 않음
+
+**중요**: 오직 JSON만 출력. SQL은 반드시 문자열로 작성."""
+
     def _get_schema_info(self) -> str:
         """
         데이터베이스 스키마 정보 정의
@@ -59,7 +202,7 @@ class SQLService:
 - _get_schema_info() 메서드에서 테이블 구조와 컬럼 설명을 정의합니다
 """
 
-    def generate_sql_with_llm(self, user_query: str, entities: Dict[str, Any] = None) -> Tuple[str, str]:
+    async def generate_sql_with_llm(self, user_query: str, entities: Dict[str, Any] = None) -> Tuple[str, str]:
         """
         LLM이 직접 SQL 쿼리를 생성
 
@@ -76,67 +219,28 @@ class SQLService:
             if filtered:
                 entity_hint = f"\n질문에 명시된 엔티티:\n{json.dumps(filtered, ensure_ascii=False, indent=2)}\n"
 
-        prompt = f"""당신은 SQL 전문가입니다. 사용자 질문을 분석하여 SQL 쿼리를 생성하세요.
-
-사용자 질문: "{user_query}"{entity_hint}
-
-{self.schema_info}
-
-다음 JSON 형식으로 응답하세요:
-{{
-    "main_sql": "메인 SQL 쿼리 (SELECT ... FROM your_table ...)",
-    "total_count_sql": "총 개수 조회 SQL (그룹핑인 경우만, 없으면 null)",
-    "query_type": "aggregation|count|lookup"
-}}
-
-**SQL 작성 규칙**:
-1. **LIMIT 자동 결정**:
-   - "상위 N개", "top N" → LIMIT N
-   - "전체", "모든", "다" → LIMIT 없음
-   - 통계 질문 기본 → LIMIT 20
-
-2. **GROUP BY 결정**:
-   - 통계/집계 질문 → 적절한 컬럼으로 GROUP BY
-   - 단순 건수 질문 → COUNT(*)
-
-3. **query_type 결정**:
-   - aggregation: 통계/집계 (GROUP BY 사용)
-   - count: 단순 건수 (COUNT만)
-   - lookup: 상세 조회 (개별 레코드)
-
-**중요**: 오직 JSON만 출력. SQL은 반드시 문자열로 작성."""
+        # 고정 접두부 뒤에 질문과 엔티티만 붙임 (vLLM prefix cache 재사용)
+        prompt = f'{self._static_sql_prompt_prefix}\n\n사용자 질문: "{user_query}"{entity_hint}'
 
         try:
-            response = requests.post(
+            result = await post_completion(
                 self.vllm_url,
-                json={
+                {
                     "model": self.model_id,
                     "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 500,
-                    "temperature": 0.1
+                    "max_tokens": 256,
+                    "temperature": 0,
+                    "seed": config.LLM_SEED,
+                    "response_format": SQL_PLAN_RESPONSE_FORMAT
                 },
+                SQLPlanSchema,
                 timeout=15
             )
-            response.raise_for_status()
-
-            result = response.json()
-            content = result["choices"][0]["message"]["content"]
-
-            # JSON 파싱
-            content = content.strip()
-            if content.startswith("```json"):
-                content = content[7:]
-            if content.startswith("```"):
-                content = content[3:]
-            if content.endswith("```"):
-                content = content[:-3]
-            content = content.strip()
+            data = SQLPlanSchema.model_validate_json(result["choices"][0]["message"]["content"])
 
-            data = json.loads(content)
-
-            main_sql = data.get("main_sql", "")
-            total_count_sql = data.get("total_count_sql")
-            query_type = data.get("query_type", "aggregation")
+            main_sql = data.main_sql
+            total_count_sql = data.total_count_sql
+            query_type = data.query_type
 
             # SQL validation
             self._validate_sql(main_sql)
@@ -151,41 +255,107 @@ class SQLService:
             raise
 
     def _validate_sql(self, sql: str):
-        """SQL 인젝션 방지를 위한 validation"""
-        sql_upper = sql.upper()
+        """SQL 인젝션 방지를 위한 validation (sqlglot AST 검증, 문자열 리터럴 안의 키워드는 허용)"""
+        parse_select_sql(sql)
+
+    def _connect(self) -> sqlite3.Connection:
+        """풀에 넣을 장기 연결 생성 (PRAGMA는 연결당 한 번만 설정)"""
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        try:
+            # journal_mode 변경은 DB에 쓰기가 필요하므로 읽기 전용 파일/잠금 상태에서는 기존 모드로 사용
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.Error as e:
+            logger.warning(f"WAL 모드 설정 실패 - 기존 저널 모드 사용: {e}")
+        conn.execute("PRAGMA cache_size=-65536")
+        conn.execute("PRAGMA mmap_size=268435456")
+        return conn
+
+    def _acquire_connection(self) -> sqlite3.Connection:
+        """
+        풀에서 연결을 가져옴 (여유가 없으면 새로 만들거나 반납될 때까지 대기)
+
+        pool_size 크기의 전용 executor에서만 호출되므로 대기는 다른 스레드의 반납 직전까지로 짧습니다.
+        """
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            pass
 
-        # 위험한 키워드 체크
-        dangerous = ["DROP", "DELETE", "UPDATE", "INSERT", "ALTER", "CREATE", "TRUNCATE", "--", ";"]
-        for keyword in dangerous:
-            if keyword in sql_upper:
-                raise ValueError(f"위험한 SQL 키워드 감지: {keyword}")
+        with self._pool_lock:
+            create = self._pool_created < self.pool_size
+            if create:
+                self._pool_created += 1
 
-        # SELECT로 시작하는지 확인
-        if not sql_upper.strip().startswith("SELECT"):
-            raise ValueError("SELECT 쿼리만 허용됩니다")
+        if not create:
+            return self._pool.get()
 
-    def execute_query(self, sql_query: str) -> List[Dict[str, Any]]:
-        """SQL 쿼리 실행"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute(sql_query)
-            rows = cursor.fetchall()
-            results = [dict(row) for row in rows]
-            conn.close()
-            logger.info(f"SQL 실행 완료: {len(results)}건")
-            return results
+            return self._connect()
+        except Exception:
+            with self._pool_lock:
+                self._pool_created -= 1
+            raise
+
+    def _run_query(self, sql_query: str) -> QueryResult:
+        """워커 스레드에서 실행되는 동기 쿼리 실행"""
+        conn = self._acquire_connection()
+        try:
+            if logger.isEnabledFor(logging.DEBUG):
+                plan = conn.execute(f"EXPLAIN QUERY PLAN {sql_query}").fetchall()
+                logger.debug("EXPLAIN QUERY PLAN:\n" + "\n".join(str(row) for row in plan))
+
+            cursor = conn.execute(sql_query)
+            columns = tuple(desc[0] for desc in cursor.description or ())
+            return QueryResult(columns, cursor.fetchall())
+        finally:
+            self._pool.put(conn)
+
+    async def execute_query(self, sql_query: str) -> QueryResult:
+        """SQL 쿼리 실행 (캐시 확인 후 이벤트 루프를 막지 않도록 쿼리 전용 스레드 풀에서 실행)"""
+        self._ensure_watcher()
+
+        cache_key = hashlib.blake2b(
+            f"{self._db_version}\x00{sql_query}".encode("utf-8"), digest_size=16
+        ).hexdigest()
+        cached = await self._sql_cache.get(cache_key)
+        if cached is not None:
+            result = QueryResult(tuple(cached[0]), cached[1])
+            logger.info(f"SQL 결과 캐시 적중: {len(result.rows)}건")
+            return result
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._run_query, sql_query
+            )
+            logger.info(f"SQL 실행 완료: {len(result.rows)}건")
         except Exception as e:
             logger.error(f"SQL 실행 실패: {e}")
             raise
 
-    def generate_sql_query(self, user_query: str, entities: Dict[str, Any] = None, question_type: str = None) -> Tuple[str, str, str]:
+        await self._sql_cache.set(cache_key, [result.columns, result.rows])
+        return result
+
+    def _ensure_watcher(self):
+        """DB 변경 감시 태스크 시작 (이벤트 루프 안에서 최초 호출 시)"""
+        if self._watcher is None or self._watcher.done():
+            self._watcher = asyncio.create_task(self._watch_db())
+
+    async def _watch_db(self):
+        """DB 파일 mtime을 주기적으로 확인하여 변경 시 SQL 결과 캐시 비움"""
+        while True:
+            await asyncio.sleep(config.SQL_CACHE_POLL_INTERVAL)
+            version = db_file_version(self.db_path)
+            if version != self._db_version:
+                logger.info("DB 변경 감지 - SQL 결과 캐시 초기화")
+                self._db_version = version
+                self._sql_cache.clear_local()
+
+    async def generate_sql_query(self, user_query: str, entities: Dict[str, Any] = None, question_type: str = None) -> Tuple[str, str, str]:
         """자연어 질문을 SQL 쿼리로 변환"""
-        sql_query, total_count_sql, query_type = self.generate_sql_with_llm(user_query, entities)
+        sql_query, total_count_sql, query_type = await self.generate_sql_with_llm(user_query, entities)
         return sql_query, query_type, total_count_sql
 
-    def search(self, user_query: str, entities: Dict[str, Any] = None, question_type: str = None) -> Tuple[List[Dict[str, Any]], str, str, int]:
+    async def search(self, user_query: str, entities: Dict[str, Any] = None, question_type: str = None) -> Tuple[QueryResult, str, str, int]:
         """
         자연어 질문으로 SQL 검색 수행
 
@@ -197,65 +367,89 @@ class SQLService:
         Returns:
             (검색 결과, SQL 쿼리, 쿼리 타입, 총 개수)
         """
-        sql_query, query_type, total_count_sql = self.generate_sql_query(user_query, entities, question_type)
-        results = self.execute_query(sql_query)
+        sql_query, query_type, total_count_sql = await self.generate_sql_query(user_query, entities, question_type)
+        return await self.search_with_sql(sql_query, total_count_sql, query_type)
+
+    async def search_with_sql(self, sql_query: str, total_count_sql: Optional[str], query_type: str) -> Tuple[QueryResult, str, str, int]:
+        """
+        이미 생성된 SQL로 검색 수행 (통합 분류기에서 SQL을 함께 생성한 경우)
+
+        Args:
+            sql_query: 메인 SQL 쿼리
+            total_count_sql: 총 개수 조회 SQL (선택)
+            query_type: 쿼리 타입
+
+        Returns:
+            (검색 결과, SQL 쿼리, 쿼리 타입, 총 개수)
+        """
+        self._validate_sql(sql_query)
+        if total_count_sql:
+            self._validate_sql(total_count_sql)
+
+        results = await self.execute_query(sql_query)
 
         total_count = None
         if total_count_sql:
-            total_result = self.execute_query(total_count_sql)
-            if total_result:
-                total_count = total_result[0].get('total', None)
+            total_result = await self.execute_query(total_count_sql)
+            total_count = total_result.first_value('total')
 
         return results, sql_query, query_type, total_count
 
-    def format_results_for_llm(self, results: List[Dict[str, Any]], query_type: str, total_count: int = None) -> str:
+    def format_results_for_llm(self, results: QueryResult, query_type: str, total_count: int = None) -> str:
         """SQL 결과를 LLM이 이해하기 쉬운 형식으로 변환"""
-        if not results:
+        if not results.rows:
             return "검색 결과가 없습니다."
 
+        row_count = len(results.rows)
         if total_count is None:
-            total_count = len(results)
+            total_count = row_count
 
         context_parts = ["=== SQL 검색 결과 ===\n"]
 
         if query_type == "aggregation":
-            if total_count and total_count > len(results):
-                context_parts.append(f"집계 결과 (총 {total_count}건 중 상위 {len(results)}건):\n")
+            if total_count and total_count > row_count:
+                context_parts.append(f"집계 결과 (총 {total_count}건 중 상위 {row_count}건):\n")
             else:
-                context_parts.append(f"집계 결과 (총 {len(results)}건):\n")
-
-            for idx, row in enumerate(results, 1):
-                parts = []
-                for key, value in row.items():
-                    if value is not None and key not in ['text', 'keywords', 'id']:
-                        parts.append(f"{key}: {value}")
-                context_parts.append(f"[{idx}] " + ", ".join(parts))
+                context_parts.append(f"집계 결과 (총 {row_count}건):\n")
+            context_parts.extend(self._format_rows(results, excluded=('text', 'keywords', 'id')))
 
         elif query_type == "count":
-            context_parts.append(f"총 건수: {results[0].get('total', results[0].get('count', len(results)))}")
+            count = results.first_value('total', 'count')
+            context_parts.append(f"총 건수: {count if count is not None else row_count}")
 
         else:  # lookup
-            context_parts.append(f"조회 결과 (총 {len(results)}건):\n")
-            for idx, row in enumerate(results, 1):
-                parts = []
-                for key, value in row.items():
-                    if value is not None and key not in ['id']:
-                        if isinstance(value, str) and len(value) > 150:
-                            value = value[:150] + "..."
-                        parts.append(f"{key}: {value}")
-                context_parts.append(f"[{idx}] " + ", ".join(parts))
+            context_parts.append(f"조회 결과 (총 {row_count}건):\n")
+            context_parts.extend(self._format_rows(results, excluded=('id',), max_len=150))
 
         return "\n".join(context_parts)
 
+    @staticmethod
+    def _format_rows(results: QueryResult, excluded: Tuple[str, ...], max_len: int = None) -> Iterator[str]:
+        """행 튜플을 컬럼 위치로 바로 읽어 "[번호] 컬럼: 값, ..." 형식 줄 생성"""
+        keep = [(i, name) for i, name in enumerate(results.columns) if name not in excluded]
+
+        for idx, row in enumerate(results.rows, 1):
+            parts = []
+            for i, name in keep:
+                value = row[i]
+                if value is None:
+                    continue
+                if max_len and isinstance(value, str) and len(value) > max_len:
+                    value = value[:max_len] + "..."
+                parts.append(f"{name}: {value}")
+            yield f"[{idx}] " + ", ".join(parts)
+
 
 # ==================== 싱글톤 인스턴스 ====================
 
 _sql_service: Optional[SQLService] = None
+_sql_service_lock = asyncio.Lock()
 
 
-def get_sql_service(db_path: str = "your_data.db") -> SQLService:
-    """싱글톤 SQL 서비스 인스턴스 반환"""
+async def get_sql_service(db_path: str = "your_data.db") -> SQLService:
+    """싱글톤 SQL 서비스 인스턴스 반환 (동시 첫 호출 시 중복 생성 방지)"""
     global _sql_service
-    if _sql_service is None:
-        _sql_service = SQLService(db_path=db_path)
+    async with _sql_service_lock:
+        if _sql_service is None:
+            _sql_service = SQLService(db_path=db_path)
     return _sql_service
@@ -190,6 +190,7 @@ async function sendMessageStream(messages, loadingElement) {
         // 스트리밍 응답 처리
         currentReader = response.body.getReader();  // reader 저장 (중단용)
         const decoder = new TextDecoder();
+        let sseBuffer = '';
         let assistantMessage = '';
         let messageElement = null;
         const thisRequestId = currentRequestId;  // 이 요청의 ID를 로컬 변수에 저장
@@ -201,8 +202,10 @@ async function sendMessageStream(messages, loadingElement) {
                     break;
                 }
 
-                const chunk = decoder.decode(value);
-                const lines = chunk.split('\n');
+                // 멀티바이트 문자와 SSE 라인이 청크 경계에서 잘릴 수 있으므로 이어 붙여서 처리
+                sseBuffer += decoder.decode(value, { stream: true });
+                const lines = sseBuffer.split('\n');
+                sseBuffer = lines.pop();
 
                 for (const line of lines) {
                     if (line.startsWith('data: ')) {